@@ -1,40 +1,431 @@
 import os
+import importlib
+import asyncio
+import hashlib
+import functools
 import numpy as np
-import requests
 import logging
-from typing import List, Dict, Any
+import logging.handlers
+import queue
+import pickle
+import mmap
+import atexit
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, TypeAdapter, ValidationError
+from diskcache import Cache
+import jinja2
 
-# Import Swarms components
-from swarms import Agent, OpenAIChat, ChromaDB
-from swarms.tools import BaseTool
-from swarms.structs import SequentialWorkflow, ConcurrentWorkflow
+# Swarms (torch, chromadb, ...), sentence-transformers, openai, httpx and faiss are slow to import;
+# load them on first use so importing this module stays cheap and side-effect free
+@functools.cache
+def _faiss():
+    return importlib.import_module("faiss")
+
+@functools.cache
+def _openai():
+    return importlib.import_module("openai")
+
+@functools.cache
+def _httpx():
+    return importlib.import_module("httpx")
+
+@functools.cache
+def _sentence_transformers():
+    # Kept apart from swarms so the embedder (FAISS memory, semantic cache) doesn't pull in all of swarms
+    return importlib.import_module("sentence_transformers")
+
+@functools.cache
+def _lazy_imports():
+    swarms = importlib.import_module("swarms")
+    return SimpleNamespace(
+        Agent=swarms.Agent,
+        OpenAIChat=swarms.OpenAIChat,
+        ChromaDB=swarms.ChromaDB,
+        BaseTool=importlib.import_module("swarms.tools").BaseTool,
+        SequentialWorkflow=importlib.import_module("swarms.structs").SequentialWorkflow,
+    )
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(filename='rehab_facility_finder.log', level=logging.INFO,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure logging on first use (entry points, memory and agent construction): callers only enqueue
+# records, a background thread writes them to disk
+@functools.cache
+def configure_logging():
+    log_queue = queue.Queue(-1)
+    log_file_handler = logging.FileHandler('rehab_facility_finder.log', delay=True)
+    log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
-# Initialize OpenAI model
-openai_model = OpenAIChat(
-    temperature=0.5,
-    openai_api_key=os.environ.get("OPENAI_API_KEY"),
-    model="gpt-3.5-turbo"
-)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+# Shared HTTP/2 connection pools so agent calls reuse TLS sessions instead of reconnecting
+def _http_limits():
+    return _httpx().Limits(max_connections=32, max_keepalive_connections=16)
+
+@functools.cache
+def get_http_client():
+    # The sync pool is thread-safe and not tied to an event loop, so one serves the whole process
+    http_client = _httpx().Client(http2=True, limits=_http_limits())
+    atexit.register(http_client.close)
+    return http_client
+
+# An httpx.AsyncClient's pool is bound to the event loop that first used it, so each loop gets its own
+_async_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+def get_openai_client():
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        client = _openai().AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            http_client=_httpx().AsyncClient(http2=True, limits=_http_limits()),
+        )
+        _async_openai_clients[loop] = client
+    return client
+
+async def close_openai_client():
+    # Close the running loop's pool before that loop shuts down
+    client = _async_openai_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
 
-# Initialize long-term memory
-memory = ChromaDB(
-    metric="cosine",
-    n_results=3,
-    output_dir="rehab_facility_data",
-    docs_folder="property_docs",
+async def run_and_close(coro):
+    # Wrapper for top-level asyncio.run calls so the loop's connections are closed on the way out
+    try:
+        return await coro
+    finally:
+        await close_openai_client()
+
+class _LoopLocalCompletions:
+    """Stands in for AsyncOpenAI().chat.completions, using the running loop's client on every call."""
+
+    async def create(self, **kwargs):
+        return await get_openai_client().chat.completions.create(**kwargs)
+
+# Bound in-flight LLM calls (LLM_CONCURRENCY, 2-8 works well) and back off on rate limits
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))
+THREAD_SEM = threading.BoundedSemaphore(LLM_CONCURRENCY)
+
+# asyncio semaphores bind to the loop that first waits on them, so each loop gets its own
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _llm_semaphores.get(loop)
+    if sem is None:
+        sem = _llm_semaphores[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return sem
+
+llm_retry = retry(
+    wait=wait_exponential_jitter(1, 30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(lambda e: isinstance(e, _openai().RateLimitError)),
+    reraise=True,
 )
 
-# Define data schemas
+@functools.cache
+def _pooled_chat_class():
+    class PooledOpenAIChat(_lazy_imports().OpenAIChat):
+        """OpenAIChat whose sync and async requests go through the shared pools."""
+
+        def __init__(self, **kwargs):
+            kwargs.setdefault("openai_api_key", os.environ.get("OPENAI_API_KEY"))
+            kwargs.setdefault("http_client", get_http_client())
+            kwargs.setdefault("async_client", _LoopLocalCompletions())
+            super().__init__(**kwargs)
+
+        # Agents run on worker threads (asyncio.to_thread), so the sync path takes the thread semaphore
+        @llm_retry
+        def _generate(self, *args, **kwargs):
+            with THREAD_SEM:
+                return super()._generate(*args, **kwargs)
+
+        @llm_retry
+        async def _agenerate(self, *args, **kwargs):
+            async with llm_semaphore():
+                return await super()._agenerate(*args, **kwargs)
+
+    return PooledOpenAIChat
+
+@llm_retry
+async def chat_completion(**kwargs):
+    async with llm_semaphore():
+        return await get_openai_client().chat.completions.create(**kwargs)
+
+# Response/embedding caching (set LLM_CACHE_DISABLE=1 to bypass for A/B runs)
+LLM_CACHE_DISABLED = os.environ.get("LLM_CACHE_DISABLE") == "1"
+LLM_CACHE_DIR = "./.llm_cache"
+
+@functools.cache
+def get_llm_cache():
+    # Created on first use so importing the module doesn't create the cache directory
+    return Cache(LLM_CACHE_DIR, eviction_policy="least-recently-used")
+
+class CachedChat:
+    """Proxy around an LLM that memoizes completions in an on-disk LRU cache by prompt hash."""
+
+    def __init__(self, llm, cache):
+        self.llm = llm
+        self.cache = cache
+
+    def _key(self, task: str) -> str:
+        # Everything that changes the completion is part of the key (e.g. a JSON-mode model_kwargs)
+        params = {
+            "model": getattr(self.llm, "model_name", None) or getattr(self.llm, "model", ""),
+            "temperature": getattr(self.llm, "temperature", None),
+            "max_tokens": getattr(self.llm, "max_tokens", None),
+            "model_kwargs": getattr(self.llm, "model_kwargs", None),
+            "task": task,
+        }
+        return hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+    def run(self, task: str, *args, **kwargs):
+        if LLM_CACHE_DISABLED:
+            return self.llm(task, *args, **kwargs)
+        key = self._key(task)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.llm(task, *args, **kwargs)
+            self.cache.set(key, response)
+        return response
+
+    def __call__(self, task: str, *args, **kwargs):
+        return self.run(task, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # Only called for missing attributes; guard "llm" so copies and unpickling (no __dict__ yet) don't recurse
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+# OpenAI model, created on first use
+@functools.cache
+def get_openai_model():
+    return CachedChat(
+        _pooled_chat_class()(
+            temperature=0.5,
+            model="gpt-3.5-turbo"
+        ),
+        get_llm_cache(),
+    )
+
+# Local 384-d embedder (same model ChromaDB uses by default), memoized per text
+EMBEDDING_DIM = 384
+@functools.cache
+def get_embedder():
+    return _sentence_transformers().SentenceTransformer("all-MiniLM-L6-v2")
+
+@functools.lru_cache(maxsize=2048)
+def _embed_cached(text: str):
+    return tuple(get_embedder().encode(text).tolist())
+
+def embed(text: str):
+    if LLM_CACHE_DISABLED:
+        return get_embedder().encode(text).tolist()
+    return list(_embed_cached(text))
+
+@functools.cache
+def _cached_chroma_class():
+    class CachedChromaDB(_lazy_imports().ChromaDB):
+        def query(self, query_text: str, *args, **kwargs):
+            # Embed through the cache instead of letting the collection re-embed the query
+            logging.info(f"Querying documents for: {query_text}")
+            docs = self.collection.query(
+                query_embeddings=[embed(query_text)],
+                n_results=self.n_results,
+                *args,
+                **kwargs,
+            )["documents"]
+            return "".join(f"{doc}\n" for doc in docs)
+
+        def add_many(self, named_documents: List[Tuple[str, str]]):
+            # Single batched upsert keyed by file name, so re-ingesting a folder never duplicates
+            if not named_documents:
+                return
+            names, documents = zip(*named_documents)
+            self.collection.upsert(
+                ids=list(names),
+                documents=list(documents),
+                embeddings=get_embedder().encode(list(documents)).tolist(),
+            )
+
+    return CachedChromaDB
+
+# Only plain-text formats are ingested; binary documents (e.g. PDFs) need converting to text first
+TEXT_DOC_EXTENSIONS = (".txt", ".md", ".csv", ".json")
+
+def load_docs(folder: str):
+    # Memory-mapped reads avoid read()'s buffered I/O; the slice below still makes one copy to decode
+    if not os.path.isdir(folder):
+        return
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if not entry.is_file():
+            continue
+        if not entry.name.lower().endswith(TEXT_DOC_EXTENSIONS):
+            logging.warning(f"Skipping non-text document {entry.path}; convert it to text to ingest it")
+            continue
+        with open(entry.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                text = mm[:].decode("utf-8", errors="replace")
+        if text.strip():
+            yield entry.name, text
+
+# The int8 quantizer learns fixed per-dimension ranges once; fewer vectors than this give ranges
+# too narrow for later additions, so small corpora stay on the exact index
+SQ8_MIN_TRAINING_VECTORS = 256
+
+class FaissMemory:
+    """Inner-product search over L2-normalized embeddings; exact by default, int8 when quantize=True."""
+
+    def __init__(self, n_results: int = 3, docs_folder: str = None, quantize: bool = False):
+        self.n_results = n_results
+        self.quantize = quantize
+        # Quantized memories start exact and switch to 8-bit scalar quantization (4x smaller than float32)
+        # once SQ8_MIN_TRAINING_VECTORS vectors are available to train on
+        self.index = _faiss().IndexFlatIP(EMBEDDING_DIM)
+        self.docs: List[str] = []
+        if docs_folder:
+            self.add_many(list(load_docs(docs_folder)))
+
+    def _vectors(self, texts: List[str]) -> np.ndarray:
+        vectors = np.array([embed(text) for text in texts], dtype=np.float32)
+        _faiss().normalize_L2(vectors)
+        return vectors
+
+    def _add_vectors(self, vectors: np.ndarray):
+        self.index.add(vectors)
+        if self.quantize and isinstance(self.index, _faiss().IndexFlatIP) and self.index.ntotal >= SQ8_MIN_TRAINING_VECTORS:
+            self.index = self._quantized_index(self.index.reconstruct_n(0, self.index.ntotal))
+
+    @staticmethod
+    def _quantized_index(vectors: np.ndarray):
+        faiss = _faiss()
+        index = faiss.IndexScalarQuantizer(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        # Fit per-dimension ranges to the corpus itself (components sit well inside [-1, 1]);
+        # mirroring the sample keeps every range symmetric around zero
+        index.train(np.vstack([vectors, -vectors]))
+        index.add(vectors)
+        return index
+
+    def add(self, document: str, *args, **kwargs):
+        self._add_vectors(self._vectors([document]))
+        self.docs.append(document)
+
+    def add_many(self, named_documents: List[Tuple[str, str]]):
+        # One batched encode for bulk ingestion instead of a model call per document
+        if not named_documents:
+            return
+        documents = [text for _, text in named_documents]
+        vectors = np.asarray(get_embedder().encode(documents), dtype=np.float32)
+        _faiss().normalize_L2(vectors)
+        self._add_vectors(vectors)
+        self.docs.extend(documents)
+
+    def query(self, query_text: str, *args, **kwargs):
+        if not self.docs:
+            return ""
+        k = min(self.n_results, len(self.docs))
+        _, ids = self.index.search(self._vectors([query_text]), k)
+        return "".join(f"{self.docs[i]}\n" for i in ids[0] if i != -1)
+
+# Long-term memory (MEMORY_BACKEND=faiss|chroma), created on first use
+MEMORY_BACKEND = os.environ.get("MEMORY_BACKEND", "faiss").lower()
+MEMORY_QUANTIZE = os.environ.get("MEMORY_QUANTIZE") == "1"  # int8 FAISS index for large corpora
+DOCS_FOLDER = "property_docs"
+INDEX_CACHE_DIR = os.path.expanduser("~/.cache/rehab")
+CHROMA_OUTPUT_DIR = "rehab_facility_data"
+CHROMA_HASH_MARKER = "docs_hash"
+
+def docs_folder_hash(folder: str = DOCS_FOLDER) -> str:
+    # Cheap fingerprint of the corpus from file names, mtimes and sizes (no content reads)
+    h = hashlib.sha256()
+    if os.path.isdir(folder):
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            if entry.is_file():
+                stat = entry.stat()
+                h.update(f"{entry.name}|{stat.st_mtime_ns}|{stat.st_size}\n".encode())
+    return h.hexdigest()
+
+def _faiss_cache_path() -> str:
+    # One file per index flavour so exact and quantized builds never overwrite each other
+    return os.path.join(INDEX_CACHE_DIR, "faiss-sq8.pkl" if MEMORY_QUANTIZE else "faiss.pkl")
+
+def _load_index_cache(corpus_hash: str):
+    try:
+        with open(_faiss_cache_path(), "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return state if state.get("hash") == corpus_hash else None
+
+def _save_index_cache(state: dict):
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    with open(_faiss_cache_path(), "wb") as f:
+        pickle.dump(state, f)
+
+def _chroma_ingested_hash():
+    try:
+        with open(os.path.join(CHROMA_OUTPUT_DIR, CHROMA_HASH_MARKER)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+@functools.cache
+def get_memory():
+    configure_logging()
+    corpus_hash = docs_folder_hash()
+
+    if MEMORY_BACKEND == "chroma":
+        # The collection persists in output_dir; the ingest marker lives next to it, and an
+        # empty collection is re-ingested even if the marker matches
+        memory = _cached_chroma_class()(
+            metric="cosine",
+            n_results=3,
+            output_dir=CHROMA_OUTPUT_DIR,
+        )
+        if _chroma_ingested_hash() != corpus_hash or memory.collection.count() == 0:
+            memory.add_many(list(load_docs(DOCS_FOLDER)))
+            os.makedirs(CHROMA_OUTPUT_DIR, exist_ok=True)
+            with open(os.path.join(CHROMA_OUTPUT_DIR, CHROMA_HASH_MARKER), "w") as f:
+                f.write(corpus_hash)
+        return memory
+
+    cached = _load_index_cache(corpus_hash)
+    if cached:
+        memory = FaissMemory(n_results=3, quantize=MEMORY_QUANTIZE)
+        memory.index = _faiss().deserialize_index(cached["index"])
+        memory.docs = cached["docs"]
+        return memory
+
+    memory = FaissMemory(n_results=3, docs_folder=DOCS_FOLDER, quantize=MEMORY_QUANTIZE)
+    _save_index_cache({
+        "hash": corpus_hash,
+        "index": _faiss().serialize_index(memory.index),
+        "docs": memory.docs,
+    })
+    return memory
+
+# Define data schemas (frozen so shared instances are safe across threads)
+FROZEN_CONFIG = ConfigDict(frozen=True, extra="forbid")
+
 class PropertySchema(BaseModel):
+    model_config = FROZEN_CONFIG
+
     address: str = Field(..., title="Property address")
     total_bedrooms: int = Field(..., title="Total number of bedrooms")
     total_bathrooms: int = Field(..., title="Total number of bathrooms")
@@ -46,95 +437,136 @@ class PropertySchema(BaseModel):
     neighborhood_score: int = Field(..., title="Neighborhood quality score (1-10)", ge=1, le=10)
 
 class ZoningSchema(BaseModel):
+    model_config = FROZEN_CONFIG
+
     allowed_use: bool = Field(..., title="Is rehab facility an allowed use?")
     max_occupancy: int = Field(..., title="Maximum allowed occupancy")
     parking_requirements: str = Field(..., title="Parking requirements")
-    special_permits_needed: List[str] = Field(default_factory=list, title="Special permits required")
+    special_permits_needed: Tuple[str, ...] = Field(default_factory=tuple, title="Special permits required")
 
 class CommunitySchema(BaseModel):
+    model_config = FROZEN_CONFIG
+
     crime_rate: float = Field(..., title="Local crime rate")
     proximity_to_services: float = Field(..., title="Distance to essential services (miles)")
     public_transport_score: int = Field(..., title="Public transportation accessibility (1-10)", ge=1, le=10)
     recovery_friendly_score: int = Field(..., title="Community support for recovery (1-10)", ge=1, le=10)
 
-# Define tools
-class PropertySearchTool(BaseTool):
-    name = "Property Search"
-    description = "Search for properties in South Florida suitable for rehab facilities"
-
-    def run(self, location: str, min_bedrooms: int, max_price: float) -> List[PropertySchema]:
-        # Placeholder implementation
-        return [PropertySchema(
-            address="123 Palm Ave, Miami, FL",
-            total_bedrooms=15,
-            total_bathrooms=10,
-            common_areas=3,
-            price=1800000,
-            square_footage=5000,
-            zoning_type="Residential",
-            proximity_to_medical=1.2,
-            neighborhood_score=8
-        )]
-
-class ZoningAnalysisTool(BaseTool):
-    name = "Zoning Analysis"
-    description = "Analyze zoning regulations for potential rehab facility properties"
-
-    def run(self, property_data: PropertySchema) -> ZoningSchema:
-        # Placeholder implementation
-        return ZoningSchema(
-            allowed_use=True,
-            max_occupancy=20,
-            parking_requirements="1 space per 4 beds",
-            special_permits_needed=["Group Home Permit"]
-        )
+class FacilityPlanSchema(BaseModel):
+    model_config = FROZEN_CONFIG
 
-class CommunityAssessmentTool(BaseTool):
-    name = "Community Assessment"
-    description = "Assess community compatibility for rehab facilities"
-
-    def run(self, property_data: PropertySchema) -> CommunitySchema:
-        # Placeholder implementation
-        return CommunitySchema(
-            crime_rate=0.02,
-            proximity_to_services=1.5,
-            public_transport_score=7,
-            recovery_friendly_score=8
-        )
+    optimal_capacity: int = Field(..., title="Optimal number of residents")
+    estimated_renovation_cost: float = Field(..., title="Estimated renovation cost")
+    renovation_timeline_months: int = Field(..., title="Renovation timeline (months)")
+    key_features: Tuple[str, ...] = Field(default_factory=tuple, title="Key facility features")
 
-class FacilityPlanningTool(BaseTool):
-    name = "Facility Planning"
-    description = "Plan and design rehab facility layout and modifications"
-
-    def run(self, property_data: PropertySchema) -> Dict[str, Any]:
-        # Placeholder implementation
-        return {
-            "optimal_capacity": 20,
-            "estimated_renovation_cost": 250000,
-            "renovation_timeline_months": 6,
-            "key_features": ["Group therapy room", "Individual counseling offices", "Meditation garden"]
-        }
+# LLM output is parsed leniently: JSON mode doesn't enforce a schema, so unknown keys are dropped
+LLM_OUTPUT_CONFIG = ConfigDict(frozen=True, extra="ignore")
 
-# Define specialized agents with prompts
-class RehabFacilityAgent(Agent):
-    def __init__(self, agent_name, system_prompt, model, tools, *args, **kwargs):
-        super().__init__(
-            llm=model,
-            agent_name=agent_name,
-            system_prompt=system_prompt,
-            tools=tools,
-            max_loops=5,
-            autosave=True,
-            dashboard=True,
-            long_term_memory=memory,
-            *args,
-            **kwargs
-        )
+class ZoningOutput(ZoningSchema):
+    model_config = LLM_OUTPUT_CONFIG
+
+class CommunityOutput(CommunitySchema):
+    model_config = LLM_OUTPUT_CONFIG
+
+class FacilityPlanOutput(FacilityPlanSchema):
+    model_config = LLM_OUTPUT_CONFIG
+
+class CombinedAnalysisSchema(BaseModel):
+    model_config = LLM_OUTPUT_CONFIG
+
+    zoning: ZoningOutput
+    community: CommunityOutput
+    plan: FacilityPlanOutput
 
-# Create specialized agents
-property_searcher = RehabFacilityAgent(
-    "Property Searcher",
-    """You are a specialized real estate agent focused on finding properties in South Florida suitable for sober living and drug rehabilitation facilities. Your task is to search for and evaluate properties based on the following criteria:
+# Placeholder tool results, validated once and shared by every call
+_PLACEHOLDER_PROPERTY = PropertySchema(
+    address="123 Palm Ave, Miami, FL",
+    total_bedrooms=15,
+    total_bathrooms=10,
+    common_areas=3,
+    price=1800000,
+    square_footage=5000,
+    zoning_type="Residential",
+    proximity_to_medical=1.2,
+    neighborhood_score=8
+)
+
+_PLACEHOLDER_ZONING = ZoningSchema(
+    allowed_use=True,
+    max_occupancy=20,
+    parking_requirements="1 space per 4 beds",
+    special_permits_needed=("Group Home Permit",)
+)
+
+_PLACEHOLDER_COMMUNITY = CommunitySchema(
+    crime_rate=0.02,
+    proximity_to_services=1.5,
+    public_transport_score=7,
+    recovery_friendly_score=8
+)
+
+_PLACEHOLDER_PLAN = FacilityPlanSchema(
+    optimal_capacity=20,
+    estimated_renovation_cost=250000,
+    renovation_timeline_months=6,
+    key_features=("Group therapy room", "Individual counseling offices", "Meditation garden")
+)
+
+# Define tools: one stub class dispatching on kind instead of a class per placeholder
+# kind -> (name, description, handler)
+_STUB_TOOL_DISPATCH = {
+    "property": (
+        "Property Search",
+        "Search for properties in South Florida suitable for rehab facilities",
+        lambda *args, **kwargs: [_PLACEHOLDER_PROPERTY],
+    ),
+    "zoning": (
+        "Zoning Analysis",
+        "Analyze zoning regulations for potential rehab facility properties",
+        lambda *args, **kwargs: _PLACEHOLDER_ZONING,
+    ),
+    "community": (
+        "Community Assessment",
+        "Assess community compatibility for rehab facilities",
+        lambda *args, **kwargs: _PLACEHOLDER_COMMUNITY,
+    ),
+    "facility": (
+        "Facility Planning",
+        "Plan and design rehab facility layout and modifications",
+        lambda *args, **kwargs: _PLACEHOLDER_PLAN,
+    ),
+}
+
+@functools.cache
+def _stub_tool_class():
+    class StubTool(_lazy_imports().BaseTool):
+        # BaseTool is a pydantic model, so instance state must be declared fields / private attrs
+        kind: str
+        name: str = ""
+        description: str = ""
+        _handler: Callable[..., Any] = PrivateAttr()
+
+        def __init__(self, kind: str, **kwargs):
+            name, description, handler = _STUB_TOOL_DISPATCH[kind]
+            super().__init__(kind=kind, name=name, description=description, **kwargs)
+            self._handler = handler
+
+        def run(self, *args, **kwargs):
+            # Placeholder implementation
+            return self._handler(*args, **kwargs)
+
+        def _run(self, *args, **kwargs):
+            return self.run(*args, **kwargs)
+
+    return StubTool
+
+def make_stub_tool(kind: str):
+    return _stub_tool_class()(kind)
+
+# System prompts, built once at import time and shared by every run
+PROMPTS = {
+    "property_searcher": """You are a specialized real estate agent focused on finding properties in South Florida suitable for sober living and drug rehabilitation facilities. Your task is to search for and evaluate properties based on the following criteria:
 
 1. Location: Focus on areas in South Florida that are conducive to recovery environments.
 2. Size: Look for properties with at least 10 bedrooms and multiple bathrooms to accommodate residents and staff.
@@ -154,13 +586,7 @@ For each property you identify, provide the following information:
 - Any known issues or advantages specific to using the property as a rehab facility
 
 Your goal is to compile a list of 3-5 promising properties that best meet these criteria. Be prepared to explain your reasoning for each selection.""",
-    openai_model,
-    [PropertySearchTool()]
-)
-
-zoning_analyst = RehabFacilityAgent(
-    "Zoning Analyst",
-    """You are a zoning analysis expert specializing in regulations related to rehabilitation facilities and group homes in South Florida. Your task is to evaluate potential properties for zoning compliance and identify any regulatory challenges. For each property, analyze the following:
+    "zoning_analyst": """You are a zoning analysis expert specializing in regulations related to rehabilitation facilities and group homes in South Florida. Your task is to evaluate potential properties for zoning compliance and identify any regulatory challenges. For each property, analyze the following:
 
 1. Current zoning classification and whether it allows for rehab facilities or group homes.
 2. If not currently allowed, assess the likelihood and process for obtaining necessary zoning variances or changes.
@@ -179,13 +605,7 @@ For each analysis, provide:
 - Recommendations for next steps in the zoning and approval process
 
 Your goal is to provide a comprehensive zoning analysis that will help decision-makers understand the regulatory landscape and potential challenges for each property.""",
-    openai_model,
-    [ZoningAnalysisTool()]
-)
-
-community_impact_assessor = RehabFacilityAgent(
-    "Community Impact Assessor",
-    """You are a community impact specialist focused on evaluating neighborhoods for their suitability in hosting sober living and drug rehabilitation facilities. Your task is to assess the community aspects of potential properties in South Florida. For each location, analyze the following factors:
+    "community_impact_assessor": """You are a community impact specialist focused on evaluating neighborhoods for their suitability in hosting sober living and drug rehabilitation facilities. Your task is to assess the community aspects of potential properties in South Florida. For each location, analyze the following factors:
 
 1. Crime rate: Evaluate the safety of the area using recent crime statistics.
 2. Proximity to services: Measure the distance to essential services such as medical facilities, pharmacies, grocery stores, and public transportation.
@@ -204,13 +624,7 @@ For each property assessment, provide:
 - Strategies for positive community engagement and integration
 
 Your goal is to provide a comprehensive community impact analysis that will help decision-makers understand the social environment and potential community dynamics for each property. This analysis should highlight both opportunities and challenges for establishing a successful rehab facility in the area.""",
-    openai_model,
-    [CommunityAssessmentTool()]
-)
-
-facility_planner = RehabFacilityAgent(
-    "Facility Planner",
-    """You are a specialized facility planner with expertise in designing and adapting properties for use as sober living and drug rehabilitation centers. Your task is to evaluate potential properties in South Florida and plan their optimal use as rehab facilities. For each property, consider the following:
+    "facility_planner": """You are a specialized facility planner with expertise in designing and adapting properties for use as sober living and drug rehabilitation centers. Your task is to evaluate potential properties in South Florida and plan their optimal use as rehab facilities. For each property, consider the following:
 
 1. Space utilization: Analyze the current layout and propose modifications to create:
    - Private and semi-private living quarters
@@ -243,43 +657,544 @@ For each property analysis, provide:
 - Recommendations for creating a supportive and therapeutic environment within the space
 
 Your goal is to provide comprehensive facility plans that maximize each property's potential as a rehab center, balancing resident needs, regulatory requirements, and operational efficiency.""",
-    openai_model,
-    [FacilityPlanningTool()]
+}
+
+# Task templates, parsed once and rendered per call
+ENV = jinja2.Environment(autoescape=False)
+FIND_TMPL = ENV.from_string(
+    "Find and analyze properties in {{ location }} for a rehab facility with a budget of ${{ budget }} and at least {{ min_bedrooms }} bedrooms"
 )
 
-# Create workflows
-sequential_workflow = SequentialWorkflow(
-    agents=[property_searcher, zoning_analyst, community_impact_assessor, facility_planner],
-    max_loops=1
+def with_memory_context(task: str) -> str:
+    # For paths that call the model directly instead of through an agent: prepend the documents the
+    # long-term memory retrieves for the task, so they see the same property_docs context
+    context = get_memory().query(task)
+    if not context:
+        return task
+    return f"Relevant property documents:\n{context}\n{task}"
+
+# Define specialized agents with prompts
+def make_rehab_agent(agent_name, system_prompt, model, tools, *args, **kwargs):
+    configure_logging()
+    return _lazy_imports().Agent(
+        llm=model,
+        agent_name=agent_name,
+        system_prompt=system_prompt,
+        tools=tools,
+        max_loops=5,
+        autosave=True,
+        dashboard=True,
+        long_term_memory=get_memory(),
+        *args,
+        **kwargs
+    )
+
+# Specialized agents. Agent keeps per-run conversation state, so every pipeline run builds its
+# own instances; the expensive parts (model, memory, embedder) are cached and shared
+def make_property_searcher():
+    return make_rehab_agent(
+        "Property Searcher",
+        PROMPTS["property_searcher"],
+        get_openai_model(),
+        [make_stub_tool("property")]
+    )
+
+def make_zoning_analyst():
+    return make_rehab_agent(
+        "Zoning Analyst",
+        PROMPTS["zoning_analyst"],
+        get_openai_model(),
+        [make_stub_tool("zoning")]
+    )
+
+def make_community_impact_assessor():
+    return make_rehab_agent(
+        "Community Impact Assessor",
+        PROMPTS["community_impact_assessor"],
+        get_openai_model(),
+        [make_stub_tool("community")]
+    )
+
+def make_facility_planner():
+    return make_rehab_agent(
+        "Facility Planner",
+        PROMPTS["facility_planner"],
+        get_openai_model(),
+        [make_stub_tool("facility")]
+    )
+
+# Combined analysis: one completion returns zoning, community and plan as a single JSON object
+@functools.cache
+def get_combined_analysis_model():
+    return CachedChat(
+        _pooled_chat_class()(
+            temperature=0.5,
+            model="gpt-3.5-turbo",
+            model_kwargs={"response_format": {"type": "json_object"}},
+        ),
+        get_llm_cache(),
+    )
+
+combined_analysis_adapter = TypeAdapter(CombinedAnalysisSchema)
+
+COMBINED_ANALYSIS_SECTIONS = "\n\n".join([
+    f"## Zoning analysis\n{PROMPTS['zoning_analyst']}",
+    f"## Community impact assessment\n{PROMPTS['community_impact_assessor']}",
+    f"## Facility planning\n{PROMPTS['facility_planner']}",
+])
+COMBINED_ANALYSIS_FORMAT = (
+    "a JSON object with the keys \"zoning\", \"community\" and \"plan\" matching this JSON schema:\n"
+    + orjson.dumps(CombinedAnalysisSchema.model_json_schema()).decode()
 )
 
-concurrent_workflow = ConcurrentWorkflow(max_workers=4)
-concurrent_workflow.add(tasks=[
-    property_searcher.run("Search for properties in Miami suitable for rehab facilities"),
-    zoning_analyst.run("Analyze zoning for 123 Palm Ave, Miami, FL"),
-    community_impact_assessor.run("Assess community impact for 123 Palm Ave, Miami, FL"),
-    facility_planner.run("Plan facility layout for 123 Palm Ave, Miami, FL")
+COMBINED_ANALYSIS_PROMPT = "\n\n".join([
+    "You perform three analyses of the same property data in a single pass. Apply each role below to the property context provided once by the user.",
+    COMBINED_ANALYSIS_SECTIONS,
+    f"Respond only with {COMBINED_ANALYSIS_FORMAT}",
 ])
 
+def analyze_combined(property_data: str) -> CombinedAnalysisSchema:
+    # A single JSON-mode completion (no agent loop, tools or memory), validated as returned
+    reply = get_combined_analysis_model().run([
+        ("system", COMBINED_ANALYSIS_PROMPT),
+        ("human", property_data),
+    ])
+    return combined_analysis_adapter.validate_json(getattr(reply, "content", reply))
+
+# Create workflows
+def make_sequential_workflow():
+    return _lazy_imports().SequentialWorkflow(
+        agents=[make_property_searcher(), make_zoning_analyst(), make_community_impact_assessor(), make_facility_planner()],
+        max_loops=1
+    )
+
+def run_concurrent_analysis(location: str = "Miami", address: str = "123 Palm Ave, Miami, FL", max_workers: int = 4):
+    # Dispatch each agent on its own worker thread; calls are deferred until submitted
+    configure_logging()
+    pairs = [
+        (make_property_searcher(), f"Search for properties in {location} suitable for rehab facilities"),
+        (make_zoning_analyst(), f"Analyze zoning for {address}"),
+        (make_community_impact_assessor(), f"Assess community impact for {address}"),
+        (make_facility_planner(), f"Plan facility layout for {address}"),
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(agent.run, prompt) for agent, prompt in pairs]
+        return [future.result() for future in futures]
+
+# Query-level result cache keyed by (location, budget, min_bedrooms, corpus_hash, variant).
+# Semantic matching on the location is opt-in (PIPELINE_SEMANTIC_CACHE=1); exact keys are the default.
+PIPELINE_CACHE_SIZE = 128
+PIPELINE_SEMANTIC_CACHE = os.environ.get("PIPELINE_SEMANTIC_CACHE") == "1"
+SEMANTIC_MATCH_THRESHOLD = float(os.environ.get("PIPELINE_SEMANTIC_THRESHOLD", "0.93"))
+
+class PipelineCache:
+    """Thread-safe LRU of pipeline results with an optional semantic fallback on the location."""
+
+    def __init__(self, maxsize: int = PIPELINE_CACHE_SIZE, semantic: bool = False,
+                 threshold: float = SEMANTIC_MATCH_THRESHOLD, embed_fn: Callable[[str], Any] = None):
+        self.maxsize = maxsize
+        self.semantic = semantic
+        self.threshold = threshold
+        self.embed_fn = embed_fn or embed
+        self._entries: "OrderedDict[tuple, Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _location_vector(self, location: str) -> np.ndarray:
+        # Only the location string is embedded, so the shared query wording can't inflate similarity
+        vector = np.asarray(self.embed_fn(location), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def get(self, key: tuple):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            if not self.semantic:
+                return None
+            candidates = [(k, v) for k, (_, v) in self._entries.items() if k[1:] == key[1:]]
+        if not candidates:
+            return None
+
+        vector = self._location_vector(key[0])
+        with self._lock:
+            # Budget, bedrooms, corpus and variant must match exactly; only the location is fuzzy
+            for seen_key, seen_vector in candidates:
+                if seen_key in self._entries and float(seen_vector @ vector) > self.threshold:
+                    self._entries.move_to_end(seen_key)
+                    return self._entries[seen_key][0]
+        return None
+
+    def set(self, key: tuple, result: str):
+        vector = self._location_vector(key[0]) if self.semantic else None
+        with self._lock:
+            self._entries[key] = (result, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+pipeline_cache = PipelineCache(semantic=PIPELINE_SEMANTIC_CACHE)
+
 # Main execution function
+async def find_rehab_facility_property_async(location: str, budget: float, min_bedrooms: int = 10, combined: bool = True):
+    configure_logging()
+    key = (location, budget, min_bedrooms, docs_folder_hash(), "combined" if combined else "individual")
+    # Semantic lookups embed the location (CPU-bound), so keep them off the event loop
+    cached = await asyncio.to_thread(pipeline_cache.get, key)
+    if cached is not None:
+        return cached
+
+    result = await _run_pipeline_async(location, budget, min_bedrooms, combined)
+    await asyncio.to_thread(pipeline_cache.set, key, result)
+    return result
+
+def _run_fresh_agent(factory: Callable[[], Any], task: str):
+    # Build the agent on the worker thread too, so construction never blocks the event loop
+    return factory().run(task)
+
+async def _run_individual_analyses(properties: str):
+    # Run the three individual agents concurrently (useful for deep follow-ups)
+    return await asyncio.gather(
+        asyncio.to_thread(_run_fresh_agent, make_zoning_analyst, properties),
+        asyncio.to_thread(_run_fresh_agent, make_community_impact_assessor, properties),
+        asyncio.to_thread(_run_fresh_agent, make_facility_planner, properties),
+    )
+
+async def _run_pipeline_async(location: str, budget: float, min_bedrooms: int, combined: bool):
+    # Search first; zoning, community and facility planning only depend on the property list
+    query = FIND_TMPL.render(location=location, budget=budget, min_bedrooms=min_bedrooms)
+    properties = await asyncio.to_thread(_run_fresh_agent, make_property_searcher, query)
+
+    if combined:
+        # Send the property context once and get all three analyses back together
+        try:
+            analysis = await asyncio.to_thread(analyze_combined, properties)
+        except ValidationError as e:
+            logging.warning(f"Combined analysis did not match the schema, falling back to individual agents: {e}")
+            combined = False
+        else:
+            zoning, community, plan = (
+                analysis.zoning.model_dump_json(),
+                analysis.community.model_dump_json(),
+                analysis.plan.model_dump_json(),
+            )
+
+    if not combined:
+        zoning, community, plan = await _run_individual_analyses(properties)
+
+    return (
+        f"Recommendation based on analysis:\n"
+        f"Properties: {properties}\n"
+        f"Zoning: {zoning}\n"
+        f"Community: {community}\n"
+        f"Facility plan: {plan}"
+    )
+
 def find_rehab_facility_property(location: str, budget: float, min_bedrooms: int = 10):
-    # Use the sequential workflow to find and analyze properties
-    result = sequential_workflow.run(
-        f"Find and analyze properties in {location} for a rehab facility with a budget of ${budget} and at least {min_bedrooms} bedrooms"
+    # Fallback: use the sequential workflow to find and analyze properties
+    configure_logging()
+    key = (location, budget, min_bedrooms, docs_folder_hash(), "sequential")
+    cached = pipeline_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = make_sequential_workflow().run(
+        FIND_TMPL.render(location=location, budget=budget, min_bedrooms=min_bedrooms)
     )
     
     # Process the result and generate a recommendation
     # This is a simplified version; you'd want to add more logic to interpret the results
-    return f"Recommendation based on analysis: {result}"
+    recommendation = f"Recommendation based on analysis: {result}"
+    pipeline_cache.set(key, recommendation)
+    return recommendation
 
-if __name__ == "__main__":
-    location = "South Florida"
-    budget = 2000000  # $2 million
-    
-    recommendation = find_rehab_facility_property(location, budget)
+# Multi-tenant coalescing: concurrent callers arriving within a short window share one completion
+COALESCE_WINDOW_SECONDS = 0.05
+COALESCE_MAX_BATCH = 16
+COALESCE_MAX_OUTPUT_TOKENS = 3500  # headroom under gpt-3.5-turbo's 4,096-token completion cap
+
+COALESCE_PROMPT_TMPL = ENV.from_string(
+    "You will receive several independent tasks, each labelled \"Task <id>\". "
+    "Handle every task on its own, using only that task's input and the instructions below.\n\n"
+    "{{ instructions }}\n\n"
+    "Respond only with a JSON object that has one key per task id (for example \"task_0\"). "
+    "The value for each task id is {{ answer_format }}."
+)
+
+class RequestCoalescer:
+    """Groups prompts submitted within a short window into a single JSON-mode completion."""
+
+    def __init__(self, instructions: str, answer_format: str, expected_output_tokens: int,
+                 window: float = COALESCE_WINDOW_SECONDS, max_batch: int = COALESCE_MAX_BATCH,
+                 max_output_tokens: int = COALESCE_MAX_OUTPUT_TOKENS, complete_fn=None):
+        self.system_prompt = COALESCE_PROMPT_TMPL.render(instructions=instructions, answer_format=answer_format)
+        self.window = window
+        # Cap the batch so the combined reply is unlikely to hit the completion token limit
+        self.max_batch = max(1, min(max_batch, max_output_tokens // expected_output_tokens))
+        self.complete_fn = complete_fn or chat_completion
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._inflight = set()
+
+    async def submit(self, prompt: str):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queues and tasks belong to one event loop; start fresh under a new one
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._collect())
+        future = loop.create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without blocking collection of the next window
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _complete(self, batch) -> Dict[str, Any]:
+        # Returns the parsed {task_id: answer} map; raises ValueError if the reply is truncated or not a JSON object
+        response = await self.complete_fn(
+            model="gpt-3.5-turbo",
+            temperature=0.5,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": "\n\n".join(
+                    f"Task task_{i}:\n{prompt}" for i, (prompt, _) in enumerate(batch)
+                )},
+            ],
+        )
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            raise ValueError("Coalesced response was truncated at the token limit")
+        answers = orjson.loads(choice.message.content)
+        if not isinstance(answers, dict):
+            raise ValueError("Coalesced response is not a JSON object")
+        return answers
+
+    async def _dispatch(self, batch):
+        try:
+            answers = await self._complete(batch)
+        except ValueError as e:
+            # orjson.JSONDecodeError is a ValueError too; one bad reply shouldn't fail every caller
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            logging.warning(f"Coalesced response for {len(batch)} tasks was unusable, retrying individually: {e}")
+            await asyncio.gather(*(self._dispatch([item]) for item in batch))
+            return
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        missing = []
+        for i, (prompt, future) in enumerate(batch):
+            if future.done():
+                continue
+            if f"task_{i}" in answers:
+                future.set_result(answers[f"task_{i}"])
+            elif len(batch) == 1:
+                future.set_exception(ValueError("Coalesced response has no answer for the task"))
+            else:
+                missing.append((prompt, future))
+        if missing:
+            await asyncio.gather(*(self._dispatch([item]) for item in missing))
+
+@functools.cache
+def get_search_coalescer():
+    return RequestCoalescer(
+        PROMPTS["property_searcher"],
+        "a string containing the full write-up for that task",
+        expected_output_tokens=900,  # 3-5 properties described in prose
+    )
+
+@functools.cache
+def get_analysis_coalescer():
+    return RequestCoalescer(
+        COMBINED_ANALYSIS_SECTIONS,
+        COMBINED_ANALYSIS_FORMAT,
+        expected_output_tokens=400,
+    )
+
+async def batched_find_rehab_facility_property(location: str, budget: float, min_bedrooms: int = 10):
+    # Same pipeline as find_rehab_facility_property_async, but each stage is coalesced across callers
+    configure_logging()
+    query = FIND_TMPL.render(location=location, budget=budget, min_bedrooms=min_bedrooms)
+    # Embedding the query for retrieval is CPU-bound, so keep it off the event loop
+    task = await asyncio.to_thread(with_memory_context, query)
+    properties = await get_search_coalescer().submit(task)
+    if not isinstance(properties, str):
+        properties = orjson.dumps(properties).decode()
+
+    try:
+        analysis = combined_analysis_adapter.validate_python(await get_analysis_coalescer().submit(properties))
+    except ValueError as e:
+        # ValidationError and unusable (truncated, unparseable, missing) replies are both ValueErrors
+        logging.warning(f"Coalesced analysis was unusable, falling back to individual agents: {e}")
+        zoning, community, plan = await _run_individual_analyses(properties)
+    else:
+        zoning, community, plan = (
+            analysis.zoning.model_dump_json(),
+            analysis.community.model_dump_json(),
+            analysis.plan.model_dump_json(),
+        )
+
+    return (
+        f"Recommendation based on analysis:\n"
+        f"Properties: {properties}\n"
+        f"Zoning: {zoning}\n"
+        f"Community: {community}\n"
+        f"Facility plan: {plan}"
+    )
+
+# Offline runs through the Batch API (50% cheaper, results within 24h); enabled with BATCH_MODE=1
+BATCH_MODE = os.environ.get("BATCH_MODE") == "1"
+
+async def _run_batch(requests: Dict[str, Dict[str, Any]], poll_interval: float = 30, max_poll_interval: float = 600) -> Dict[str, Any]:
+    # requests maps custom_id -> chat completion body; returns custom_id -> message content (None on error)
+    if not requests:
+        return {}
+    payload = b"".join(
+        orjson.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + b"\n"
+        for custom_id, body in requests.items()
+    )
+    input_file = await get_openai_client().files.create(file=("batch_input.jsonl", payload), purpose="batch")
+    batch = await get_openai_client().batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logging.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+        batch = await get_openai_client().batches.retrieve(batch.id)
+
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} finished with status {batch.status}")
+
+    results: Dict[str, Any] = dict.fromkeys(requests)
+    # Successful requests land in the output file, failed ones in the error file; either may be absent
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await get_openai_client().files.content(file_id)
+        for line in content.content.splitlines():
+            if not line:
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error")
+                logging.warning(f"Batch {batch.id} request {record['custom_id']} failed: {error}")
+                continue
+            results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+    failed = sum(result is None for result in results.values())
+    if failed:
+        logging.warning(f"Batch {batch.id}: {failed} of {len(results)} requests returned no result")
+    return results
+
+async def run_offline_batch(jobs: List[Dict[str, Any]]) -> Dict[str, str]:
+    # Each job is {"location", "budget", optional "min_bedrooms", optional "custom_id"}
+    configure_logging()
+    queries = {
+        job.get("custom_id", f"job-{i}"): FIND_TMPL.render(
+            location=job["location"], budget=job["budget"], min_bedrooms=job.get("min_bedrooms", 10)
+        )
+        for i, job in enumerate(jobs)
+    }
+
+    # Stage 1: property search for every job, with the same property_docs retrieval as the online pipeline
+    contexts = await asyncio.gather(*(asyncio.to_thread(with_memory_context, query) for query in queries.values()))
+    properties = await _run_batch({
+        custom_id: {
+            "model": "gpt-3.5-turbo",
+            "temperature": 0.5,
+            "messages": [
+                {"role": "system", "content": PROMPTS["property_searcher"]},
+                {"role": "user", "content": task},
+            ],
+        }
+        for custom_id, task in zip(queries, contexts)
+    })
+
+    # Stage 2: combined zoning/community/plan analysis on each search result
+    analyses = await _run_batch({
+        custom_id: {
+            "model": "gpt-3.5-turbo",
+            "temperature": 0.5,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": COMBINED_ANALYSIS_PROMPT},
+                {"role": "user", "content": found},
+            ],
+        }
+        for custom_id, found in properties.items()
+        if found is not None
+    })
+
+    # Validate stage-2 output the same way the online path does
+    recommendations = {}
+    for custom_id, raw in analyses.items():
+        if raw is None:
+            continue
+        try:
+            analysis = combined_analysis_adapter.validate_json(raw)
+        except ValidationError as e:
+            logging.warning(f"Batch analysis for {custom_id} did not match the schema: {e}")
+            continue
+        recommendations[custom_id] = (
+            f"Recommendation based on analysis:\n"
+            f"Properties: {properties[custom_id]}\n"
+            f"Zoning: {analysis.zoning.model_dump_json()}\n"
+            f"Community: {analysis.community.model_dump_json()}\n"
+            f"Facility plan: {analysis.plan.model_dump_json()}"
+        )
+    return recommendations
+
+async def main(location: str, budget: float):
+    recommendation = await find_rehab_facility_property_async(location, budget)
     print("Final Property Recommendation:")
     print(recommendation)
 
     # Save recommendation to file
     with open("rehab_facility_recommendation.txt", "w") as f:
         f.write(recommendation)
+
+if __name__ == "__main__":
+    location = "South Florida"
+    budget = 2000000  # $2 million
+
+    if BATCH_MODE:
+        results = asyncio.run(run_and_close(run_offline_batch([{"location": location, "budget": budget}])))
+        with open("rehab_facility_recommendation.txt", "w") as f:
+            f.write("\n\n".join(results.values()))
+        print("\n\n".join(results.values()))
+    else:
+        asyncio.run(run_and_close(main(location, budget)))
@@ -0,0 +1,18 @@
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+MODULE_PATH = pathlib.Path(__file__).resolve().parent.parent / "Facility-Planning-Tool.py"
+
+
+@pytest.fixture(scope="session")
+def fpt():
+    # The script's file name isn't a valid module name, so load it from its path
+    spec = importlib.util.spec_from_file_location("facility_planning_tool", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Registered like a normal import so pickle can find its classes
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,47 @@
+import copy
+import pickle
+
+
+class DictCache(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+class FakeLLM:
+    def __init__(self, model_kwargs=None):
+        self.model_name = "gpt-3.5-turbo"
+        self.temperature = 0.5
+        self.model_kwargs = model_kwargs or {}
+        self.calls = 0
+
+    def __call__(self, task, *args, **kwargs):
+        self.calls += 1
+        return f"{task} #{self.calls}"
+
+
+def test_repeated_task_is_served_from_cache(fpt):
+    llm = FakeLLM()
+    chat = fpt.CachedChat(llm, DictCache())
+
+    assert chat("hello") == "hello #1"
+    assert chat("hello") == "hello #1"
+    assert llm.calls == 1
+
+
+def test_model_kwargs_are_part_of_the_key(fpt):
+    cache = DictCache()
+    plain = fpt.CachedChat(FakeLLM(), cache)
+    json_mode = fpt.CachedChat(FakeLLM({"response_format": {"type": "json_object"}}), cache)
+
+    assert plain._key("hello") != json_mode._key("hello")
+    plain("hello")
+    assert json_mode("hello") == "hello #1"
+    assert json_mode.llm.calls == 1
+
+
+def test_copies_and_pickles_without_recursing(fpt):
+    chat = fpt.CachedChat(FakeLLM(), DictCache())
+
+    assert copy.copy(chat).llm is chat.llm
+    assert copy.deepcopy(chat).model_name == "gpt-3.5-turbo"
+    assert pickle.loads(pickle.dumps(chat)).temperature == 0.5
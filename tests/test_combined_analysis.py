@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from pydantic import ValidationError
+
+ANALYSIS = {
+    "zoning": {"allowed_use": True, "max_occupancy": 20, "parking_requirements": "1 per 4 beds", "notes": "extra"},
+    "community": {"crime_rate": 0.02, "proximity_to_services": 1.5, "public_transport_score": 7, "recovery_friendly_score": 8},
+    "plan": {"optimal_capacity": 20, "estimated_renovation_cost": 250000, "renovation_timeline_months": 6},
+}
+
+
+class FakeModel:
+    def __init__(self, content):
+        self.content = content
+        self.tasks = []
+
+    def run(self, task):
+        self.tasks.append(task)
+        return SimpleNamespace(content=self.content)
+
+
+def test_combined_analysis_is_one_completion(fpt, monkeypatch):
+    model = FakeModel(orjson.dumps(ANALYSIS).decode())
+    monkeypatch.setattr(fpt, "get_combined_analysis_model", lambda: model)
+
+    analysis = fpt.analyze_combined("123 Palm Ave")
+
+    assert analysis.zoning.max_occupancy == 20
+    assert analysis.plan.key_features == ()
+    assert model.tasks == [[("system", fpt.COMBINED_ANALYSIS_PROMPT), ("human", "123 Palm Ave")]]
+
+
+def test_combined_analysis_rejects_incomplete_output(fpt, monkeypatch):
+    monkeypatch.setattr(fpt, "get_combined_analysis_model", lambda: FakeModel('{"zoning": {}}'))
+
+    with pytest.raises(ValidationError):
+        fpt.analyze_combined("123 Palm Ave")
@@ -0,0 +1,42 @@
+import asyncio
+
+
+def test_each_event_loop_gets_its_own_openai_client(fpt, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+
+    async def client_pair():
+        return fpt.get_openai_client(), fpt.get_openai_client()
+
+    first, again = asyncio.run(client_pair())
+    second, _ = asyncio.run(client_pair())
+
+    assert first is again
+    assert first is not second
+
+
+def test_run_and_close_closes_the_loop_client(fpt, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+
+    async def use_client():
+        return fpt.get_openai_client()
+
+    client = asyncio.run(fpt.run_and_close(use_client()))
+
+    assert client.is_closed()
+
+
+def test_llm_semaphore_survives_a_second_event_loop(fpt):
+    async def contend():
+        sem = fpt.llm_semaphore()
+
+        async def hold():
+            async with sem:
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(hold() for _ in range(fpt.LLM_CONCURRENCY * 2)))
+        return sem
+
+    first = asyncio.run(contend())
+    second = asyncio.run(contend())
+
+    assert first is not second
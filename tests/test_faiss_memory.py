@@ -0,0 +1,37 @@
+import faiss
+import numpy as np
+
+
+def unit_vectors(n, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def test_quantized_memory_stays_exact_below_training_minimum(fpt):
+    memory = fpt.FaissMemory(quantize=True)
+    memory._add_vectors(unit_vectors(1, fpt.EMBEDDING_DIM))
+    memory._add_vectors(unit_vectors(10, fpt.EMBEDDING_DIM, seed=1))
+
+    assert isinstance(memory.index, faiss.IndexFlatIP)
+    assert memory.index.ntotal == 11
+
+
+def test_quantized_memory_switches_to_sq8_with_enough_vectors(fpt):
+    vectors = unit_vectors(fpt.SQ8_MIN_TRAINING_VECTORS + 44, fpt.EMBEDDING_DIM)
+    memory = fpt.FaissMemory(quantize=True)
+    memory._add_vectors(vectors[:1])
+    memory._add_vectors(vectors[1:])
+
+    assert isinstance(memory.index, faiss.IndexScalarQuantizer)
+    assert memory.index.ntotal == len(vectors)
+    # Every stored vector is still its own nearest neighbour after quantization
+    _, ids = memory.index.search(vectors, 1)
+    assert (ids[:, 0] == np.arange(len(vectors))).mean() > 0.99
+
+
+def test_exact_memory_never_quantizes(fpt):
+    memory = fpt.FaissMemory()
+    memory._add_vectors(unit_vectors(fpt.SQ8_MIN_TRAINING_VECTORS, fpt.EMBEDDING_DIM))
+
+    assert isinstance(memory.index, faiss.IndexFlatIP)
@@ -0,0 +1,35 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+
+ANALYSIS = {
+    "zoning": {"allowed_use": True, "max_occupancy": 20, "parking_requirements": "1 per 4 beds"},
+    "community": {"crime_rate": 0.02, "proximity_to_services": 1.5, "public_transport_score": 7, "recovery_friendly_score": 8},
+    "plan": {"optimal_capacity": 20, "estimated_renovation_cost": 250000, "renovation_timeline_months": 6},
+}
+
+
+def test_offline_batch_retrieves_memory_and_validates_analyses(fpt, monkeypatch):
+    stages = []
+
+    async def fake_run_batch(requests):
+        stages.append(requests)
+        if len(stages) == 1:
+            return {custom_id: f"properties for {custom_id}" for custom_id in requests}
+        return {"miami": orjson.dumps(ANALYSIS).decode(), "tampa": '{"zoning": {}}'}
+
+    monkeypatch.setattr(fpt, "_run_batch", fake_run_batch)
+    monkeypatch.setattr(fpt, "configure_logging", lambda: None)
+    monkeypatch.setattr(fpt, "get_memory", lambda: SimpleNamespace(query=lambda task: "Listing: 9 Ocean Dr\n"))
+
+    results = asyncio.run(fpt.run_offline_batch([
+        {"location": "Miami", "budget": 2000000, "custom_id": "miami"},
+        {"location": "Tampa", "budget": 1500000, "custom_id": "tampa"},
+    ]))
+
+    search_task = stages[0]["miami"]["messages"][1]["content"]
+    assert "Listing: 9 Ocean Dr" in search_task
+    assert search_task.endswith(fpt.FIND_TMPL.render(location="Miami", budget=2000000, min_bedrooms=10))
+    assert list(results) == ["miami"]
+    assert "Properties: properties for miami" in results["miami"]
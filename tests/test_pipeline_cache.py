@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def fake_embed(vectors):
+    return lambda text: vectors[text]
+
+
+def make_key(location="Miami", budget=2000000, min_bedrooms=10, corpus_hash="h1", variant="combined"):
+    return (location, budget, min_bedrooms, corpus_hash, variant)
+
+
+def test_exact_hit_and_miss(fpt):
+    cache = fpt.PipelineCache(maxsize=4)
+    cache.set(make_key(), "miami result")
+
+    assert cache.get(make_key()) == "miami result"
+    assert cache.get(make_key(location="Orlando")) is None
+
+
+def test_lru_eviction_drops_least_recently_used(fpt):
+    cache = fpt.PipelineCache(maxsize=2)
+    cache.set(make_key(location="A"), "a")
+    cache.set(make_key(location="B"), "b")
+    # Touch A so B becomes the least recently used entry
+    assert cache.get(make_key(location="A")) == "a"
+    cache.set(make_key(location="C"), "c")
+
+    assert cache.get(make_key(location="B")) is None
+    assert cache.get(make_key(location="A")) == "a"
+    assert cache.get(make_key(location="C")) == "c"
+
+
+def test_keys_isolated_by_variant_and_corpus_hash(fpt):
+    cache = fpt.PipelineCache(maxsize=8)
+    cache.set(make_key(variant="combined", corpus_hash="h1"), "combined h1")
+
+    assert cache.get(make_key(variant="individual", corpus_hash="h1")) is None
+    assert cache.get(make_key(variant="sequential", corpus_hash="h1")) is None
+    assert cache.get(make_key(variant="combined", corpus_hash="h2")) is None
+
+
+def test_semantic_matching_is_off_by_default(fpt):
+    calls = []
+
+    def embed_fn(text):
+        calls.append(text)
+        return [1.0, 0.0]
+
+    cache = fpt.PipelineCache(maxsize=4, embed_fn=embed_fn)
+    cache.set(make_key(location="Miami"), "miami result")
+
+    assert cache.get(make_key(location="Miami area")) is None
+    assert calls == []
+
+
+def test_semantic_match_on_location_only(fpt):
+    vectors = {
+        "Miami": np.array([1.0, 0.0]),
+        "Miami, FL": np.array([0.99, 0.05]),
+        "Miami Beach": np.array([0.8, 0.6]),
+    }
+    cache = fpt.PipelineCache(maxsize=4, semantic=True, threshold=0.93, embed_fn=fake_embed(vectors))
+    cache.set(make_key(location="Miami"), "miami result")
+
+    assert cache.get(make_key(location="Miami, FL")) == "miami result"
+    assert cache.get(make_key(location="Miami Beach")) is None
+
+
+def test_semantic_match_requires_other_key_parts_to_match(fpt):
+    vectors = {"Miami": np.array([1.0, 0.0]), "Miami, FL": np.array([1.0, 0.0])}
+    cache = fpt.PipelineCache(maxsize=4, semantic=True, embed_fn=fake_embed(vectors))
+    cache.set(make_key(location="Miami"), "miami result")
+
+    assert cache.get(make_key(location="Miami, FL", budget=1000000)) is None
+    assert cache.get(make_key(location="Miami, FL", variant="individual")) is None
+    assert cache.get(make_key(location="Miami, FL", corpus_hash="h2")) is None
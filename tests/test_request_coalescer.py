@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+
+
+def make_response(content, finish_reason="stop"):
+    return SimpleNamespace(choices=[SimpleNamespace(finish_reason=finish_reason, message=SimpleNamespace(content=content))])
+
+
+def task_ids(kwargs):
+    user = kwargs["messages"][1]["content"]
+    return [line.split()[1].rstrip(":") for line in user.splitlines() if line.startswith("Task task_")]
+
+
+class FakeCompletion:
+    """Answers every task with its own prompt unless a reply override is queued."""
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def __call__(self, **kwargs):
+        self.calls.append(task_ids(kwargs))
+        if self.replies:
+            return self.replies.pop(0)
+        user = kwargs["messages"][1]["content"]
+        answers = {}
+        for block in user.split("\n\n"):
+            header, prompt = block.split("\n", 1)
+            answers[header.split()[1].rstrip(":")] = prompt.upper()
+        return make_response(orjson.dumps(answers).decode())
+
+
+def make_coalescer(fpt, complete_fn, **kwargs):
+    kwargs.setdefault("expected_output_tokens", 100)
+    return fpt.RequestCoalescer("Do the thing.", "a string", complete_fn=complete_fn, window=0.05, **kwargs)
+
+
+def submit_all(coalescer, prompts):
+    async def run():
+        return await asyncio.gather(*(coalescer.submit(p) for p in prompts), return_exceptions=True)
+    return asyncio.run(run())
+
+
+def test_concurrent_submissions_share_one_completion(fpt):
+    fake = FakeCompletion()
+    results = submit_all(make_coalescer(fpt, fake), ["a", "b", "c"])
+
+    assert results == ["A", "B", "C"]
+    assert len(fake.calls) == 1
+
+
+def test_batch_size_is_capped_by_output_token_budget(fpt):
+    fake = FakeCompletion()
+    coalescer = make_coalescer(fpt, fake, expected_output_tokens=1000, max_output_tokens=2500)
+    results = submit_all(coalescer, ["a", "b", "c", "d", "e"])
+
+    assert coalescer.max_batch == 2
+    assert results == ["A", "B", "C", "D", "E"]
+    assert max(len(call) for call in fake.calls) <= 2
+
+
+def test_unparseable_reply_retries_tasks_individually(fpt):
+    fake = FakeCompletion(replies=[make_response('{"task_0": "trunc')])
+    results = submit_all(make_coalescer(fpt, fake), ["a", "b", "c"])
+
+    assert results == ["A", "B", "C"]
+    assert fake.calls[0] == ["task_0", "task_1", "task_2"]
+    assert sorted(map(len, fake.calls[1:])) == [1, 1, 1]
+
+
+def test_truncated_reply_retries_tasks_individually(fpt):
+    fake = FakeCompletion(replies=[make_response('{"task_0": "x", "task_1": "y"}', finish_reason="length")])
+    results = submit_all(make_coalescer(fpt, fake), ["a", "b"])
+
+    assert results == ["A", "B"]
+    assert len(fake.calls) == 3
+
+
+def test_missing_answer_is_retried_on_its_own(fpt):
+    fake = FakeCompletion(replies=[make_response('{"task_0": "first"}')])
+    results = submit_all(make_coalescer(fpt, fake), ["a", "b"])
+
+    assert results == ["first", "B"]
+    assert fake.calls == [["task_0", "task_1"], ["task_0"]]
+
+
+def test_single_task_failure_is_not_retried_forever(fpt):
+    fake = FakeCompletion(replies=[make_response("not json")])
+    (result,) = submit_all(make_coalescer(fpt, fake), ["a"])
+
+    assert isinstance(result, ValueError)
+    assert len(fake.calls) == 1
+
+
+def test_api_error_fails_the_whole_batch(fpt):
+    async def failing(**kwargs):
+        raise ConnectionError("boom")
+
+    results = submit_all(make_coalescer(fpt, failing), ["a", "b"])
+
+    assert all(isinstance(r, ConnectionError) for r in results)
+
+
+def test_analysis_prompt_asks_for_a_task_map_only(fpt):
+    prompt = fpt.get_analysis_coalescer().system_prompt
+
+    assert "one key per task id" in prompt
+    assert "Respond only with a JSON object with the keys" not in prompt
+    assert '"zoning", "community" and "plan"' in prompt
+
+
+class FixedCoalescer:
+    def __init__(self, answer):
+        self.answer = answer
+        self.prompts = []
+
+    async def submit(self, prompt):
+        self.prompts.append(prompt)
+        return self.answer
+
+
+def test_batched_pipeline_falls_back_on_a_bad_analysis(fpt, monkeypatch):
+    search = FixedCoalescer("9 Ocean Dr, 12 bedrooms")
+    monkeypatch.setattr(fpt, "configure_logging", lambda: None)
+    monkeypatch.setattr(fpt, "get_memory", lambda: SimpleNamespace(query=lambda task: "Listing: 9 Ocean Dr\n"))
+    monkeypatch.setattr(fpt, "get_search_coalescer", lambda: search)
+    monkeypatch.setattr(fpt, "get_analysis_coalescer", lambda: FixedCoalescer({"zoning": {}}))
+
+    async def individual(properties):
+        return f"zoning of {properties}", "community", "plan"
+
+    monkeypatch.setattr(fpt, "_run_individual_analyses", individual)
+    result = asyncio.run(fpt.batched_find_rehab_facility_property("Miami", 2000000))
+
+    assert search.prompts[0].startswith("Relevant property documents:\nListing: 9 Ocean Dr\n")
+    assert "Zoning: zoning of 9 Ocean Dr, 12 bedrooms" in result
+    assert result.endswith("Facility plan: plan")